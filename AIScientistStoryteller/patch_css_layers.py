@@ -12,7 +12,8 @@ USO:
   # opzionale: python patch_css_layers.py --root src
 """
 
-import os, re, argparse, io
+import os, re, argparse, pathlib
+from concurrent.futures import ProcessPoolExecutor
 
 TARGET_SELECTOR_KEYWORDS = [
     "navbar", "navbarShell",
@@ -29,104 +30,106 @@ CONFLICTING_PROPS = [
     r"border(?:-color|(?:-radius)?)?"
 ]
 
-conflicting_re = re.compile(r"^\s*(" + "|".join(CONFLICTING_PROPS) + r")\s*:\s*[^;]+;.*$", re.IGNORECASE)
+conflicting_re = re.compile(r"^\s*(" + "|".join(CONFLICTING_PROPS) + r")\s*:\s*[^;]+;.*$", re.IGNORECASE | re.MULTILINE)
 important_re = re.compile(r"!\s*important", re.IGNORECASE)
+# regola CSS "innermost": selettore { corpo senza graffe } — una sola traversata C-level
+rule_re = re.compile(r"([^{}]+)\{([^{}]*)\}")
+# membership dei selettori target come singola alternation compilata
+# (una traversata C invece di 13 scan substring in Python)
+target_re = re.compile("|".join(map(re.escape, TARGET_SELECTOR_KEYWORDS)), re.IGNORECASE)
 
 def should_skip(path: str) -> bool:
-    base = os.path.basename(path).lower()
+    # un solo lower() sul path normalizzato, basename derivato da quello
+    norm = path.replace("\\", "/").lower()
+    base = norm.rsplit("/", 1)[-1]
     if base in ("global.css", "globals.css"):
         return True
     # evita cartelle/nomi "global"
-    norm = path.replace("\\", "/").lower()
     return "/global/" in norm
 
+def cannot_change(txt: str) -> bool:
+    """Pre-filtro veloce su substring: True se process_css non può modificare il file."""
+    if "@layer" not in txt:
+        return False  # verrebbe comunque wrappato nel layer
+    if not target_re.search(txt):
+        return True   # nessun selettore target → niente da riscrivere
+    low = txt.lower()
+    # important_re, non il literal: "! important" (spazio legale) conta come patchabile
+    return (important_re.search(txt) is None
+            and not any(p in low for p in ("background", "box-shadow", "border")))
+
 def selector_is_target(selector: str) -> bool:
-    s = selector.lower()
-    return any(k in s for k in TARGET_SELECTOR_KEYWORDS)
+    return bool(target_re.search(selector))
+
+def _comment_out(m: re.Match) -> str:
+    return "/* " + m.group(0).strip() + "  — disabled by global glass theme */"
 
 def process_css(text: str) -> tuple[str, bool]:
     changed = False
-    has_layer = "@layer" in text
 
     # incapsula tutto in un layer se non già presente
-    if not has_layer:
+    if "@layer" not in text:
         text = "@layer components {\n" + text + "\n}\n"
         changed = True
 
-    lines = text.splitlines()
-    out = []
-    in_block = False
-    brace_depth = 0
-    current_selector = ""
-
-    for line in lines:
-        if not in_block and "{" in line:
-            # inizio regola
-            current_selector = line.split("{")[0].strip()
-            in_block = True
-            brace_depth = line.count("{") - line.count("}")
-            out.append(line)
-            continue
-
-        if in_block:
-            brace_depth += line.count("{")
-            brace_depth -= line.count("}")
-
-            if selector_is_target(current_selector):
-                # rimuovi !important
-                if "!" in line and important_re.search(line):
-                    new_line = important_re.sub("", line)
-                    if new_line != line:
-                        line = new_line
-                        changed = True
-                # commenta proprietà in conflitto
-                if conflicting_re.match(line):
-                    out.append("/* " + line.strip() + "  — disabled by global glass theme */")
-                    changed = True
-                    if brace_depth == 0:
-                        in_block = False
-                        current_selector = ""
-                    continue
-
-            out.append(line)
-
-            if brace_depth <= 0:
-                in_block = False
-                current_selector = ""
-            continue
-
-        out.append(line)
-
-    return "\n".join(out), changed
+    # una sola passata regex sull'intero file al posto del loop per-riga
+    # con conteggio graffe; matcha le regole più interne, quindi funziona
+    # anche dentro @media/nesting (il wrapper esterno resta intatto)
+    def _patch_rule(m: re.Match) -> str:
+        nonlocal changed
+        selector, body = m.group(1), m.group(2)
+        if not selector_is_target(selector):
+            return m.group(0)
+        new_body = important_re.sub("", body)          # rimuovi !important
+        new_body = conflicting_re.sub(_comment_out, new_body)  # commenta proprietà in conflitto
+        if new_body != body:
+            changed = True
+            return selector + "{" + new_body + "}"
+        return m.group(0)
+
+    return rule_re.sub(_patch_rule, text), changed
+
+def iter_css_files(root: str):
+    # ricorsione con os.scandir: riusa il DirEntry e fa meno stat() di os.walk
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_css_files(entry.path)
+            elif entry.name.lower().endswith((".css", ".scss", ".sass")):
+                yield entry.path
+
+def _process_file(full: str) -> bool:
+    """Worker indipendente per file: legge, pre-filtra, patcha e scrive. Ritorna True se patchato."""
+    try:
+        txt = pathlib.Path(full).read_bytes().decode("utf-8", "ignore")
+    except OSError:
+        return False
+
+    # salta subito i file che non possono cambiare (la stragrande maggioranza)
+    if cannot_change(txt):
+        return False
+
+    new_txt, changed = process_css(txt)
+    if changed:
+        # il file originale diventa il backup con una rename: niente ri-scrittura dei byte vecchi
+        os.replace(full, full + ".bak")
+        pathlib.Path(full).write_bytes(new_txt.encode("utf-8"))
+    return changed
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--root", default=".", help="cartella root da cui cercare i CSS (default: .)")
     args = ap.parse_args()
 
+    candidates = [p for p in iter_css_files(args.root) if not should_skip(p)]
+
+    # ogni file è indipendente → fan-out su tutti i core (regex CPU-bound, GIL aggirato)
     patched = 0
-    for root, _, files in os.walk(args.root):
-        for f in files:
-            if not f.lower().endswith((".css", ".scss", ".sass")):
-                continue
-            full = os.path.join(root, f)
-            if should_skip(full):
-                continue
-            try:
-                with open(full, "r", encoding="utf-8", errors="ignore") as fh:
-                    txt = fh.read()
-            except:
-                continue
-
-            new_txt, changed = process_css(txt)
+    with ProcessPoolExecutor() as ex:
+        for full, changed in zip(candidates, ex.map(_process_file, candidates, chunksize=16)):
             if changed:
-                bak = full + ".bak"
-                with open(bak, "w", encoding="utf-8") as fh:
-                    fh.write(txt)
-                with open(full, "w", encoding="utf-8") as fh:
-                    fh.write(new_txt)
                 patched += 1
-                print(f"[patched] {os.path.relpath(full, args.root)}  (backup: {os.path.relpath(bak, args.root)})")
+                print(f"[patched] {os.path.relpath(full, args.root)}  (backup: {os.path.relpath(full + '.bak', args.root)})")
 
     print(f"\nDone. Patched files: {patched}")
 